@@ -354,6 +354,29 @@ class WebInterface(object):
         self.check_token(token)
         return self.__success(**self.__gateway_api.get_status())
 
+    @cherrypy.expose
+    def get_bundle(self, token, items):
+        """ Get the responses for multiple get endpoints in one call, to avoid a http
+        round trip per endpoint.
+
+        :param items: comma separated list of endpoint names, e.g. \
+        'get_output_status,get_errors'. Only endpoints that take just a token can be bundled.
+        :returns: 'bundle': dict mapping each endpoint name on its response dict.
+        """
+        self.check_token(token)
+        bundle = {}
+        for item in items.split(','):
+            method = getattr(self, item, None)
+            if item == 'get_bundle' or not item.startswith('get_') \
+                    or method is None or not getattr(method, 'exposed', False):
+                bundle[item] = {'success': False, 'msg': 'unknown_item'}
+            else:
+                try:
+                    bundle[item] = json.loads(method(token))
+                except Exception as exception:
+                    bundle[item] = {'success': False, 'msg': str(exception)}
+        return self.__success(bundle=bundle)
+
     @cherrypy.expose
     def get_output_status(self, token):
         """ Get the status of the outputs.
@@ -19,32 +19,69 @@ pressed in the last 5 minutes.
 @author: fryckbos
 """
 
+import array
 import time
 
+# Monotonic clock: immune to wall-clock jumps (NTP adjustments), and bound to
+# a module-level name to skip the module-dict lookup on every call. Falls back
+# to time.time on pythons without time.monotonic.
+_monotonic = getattr(time, 'monotonic', time.time)
+
 class InputStatus(object):
-    """ Contains the last x inputs pressed the last y minutes. """
+    """ Contains the last x inputs pressed the last y minutes.
+
+    Timestamps are taken from the monotonic clock, not the wall-clock: they
+    are only used for interval arithmetic and are never exposed.
+    """
 
     def __init__(self, num_inputs=5, seconds=10):
         """ Create an InputStatus, specifying the number of inputs to track and
         the number of seconds to keep the data. """
         self.__num_inputs = num_inputs
         self.__seconds = seconds
-        self.__inputs = []
+        # Fixed-capacity ring buffer: __times[i] is the timestamp for
+        # __data[i]. __head is the oldest entry, __count the number of live
+        # entries; adding to a full buffer overwrites the oldest entry.
+        self.__times = array.array('d', [0.0] * num_inputs)
+        self.__data = [None] * num_inputs
+        self.__head = 0
+        self.__count = 0
+        # Earliest moment at which an entry can expire: __clean is a no-op
+        # before this, so the common "nothing expired yet" case skips the scan.
+        self.__next_expiry = float('inf')
 
-    def __clean(self):
+    def __clean(self, now=None):
         """ Remove the old input data. """
-        threshold = time.time() - self.__seconds
-        self.__inputs = [i for i in self.__inputs if i[0] > threshold]
+        if now is None:
+            now = _monotonic()
+        if now < self.__next_expiry:
+            return
+        threshold = now - self.__seconds
+        while self.__count > 0 and self.__times[self.__head] <= threshold:
+            self.__data[self.__head] = None
+            self.__head = (self.__head + 1) % self.__num_inputs
+            self.__count -= 1
+        if self.__count > 0:
+            self.__next_expiry = self.__times[self.__head] + self.__seconds
+        else:
+            self.__next_expiry = float('inf')
 
     def add_data(self, data):
         """ Add input data. """
-        self.__clean()
-        while len(self.__inputs) >= self.__num_inputs:
-            self.__inputs.pop(0)
-
-        self.__inputs.append((time.time(), data))
+        now = _monotonic()
+        self.__clean(now)
+        index = (self.__head + self.__count) % self.__num_inputs
+        if self.__count == self.__num_inputs:
+            self.__head = (self.__head + 1) % self.__num_inputs
+        else:
+            self.__count += 1
+        self.__times[index] = now
+        self.__data[index] = data
+        if self.__count == 1:
+            self.__next_expiry = now + self.__seconds
 
     def get_status(self):
         """ Get the last inputs. """
         self.__clean()
-        return [i[1] for i in self.__inputs]
+        return [self.__data[(self.__head + i) % self.__num_inputs]
+                for i in range(self.__count)]
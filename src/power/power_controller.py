@@ -163,6 +163,12 @@ class PowerController(object):
                                   (new_address, old_address))
             self.__connection.commit()
 
+    def reset(self):
+        """ Remove all registered power modules. """
+        with self.__lock:
+            self.__cursor.execute("DELETE FROM power_modules;")
+            self.__connection.commit()
+
     def get_free_address(self):
         """ Get a free address for a power module. """
         max_address = 0
@@ -18,26 +18,52 @@ if required. On each check the vpn_service sends some status information about t
 thermostats to the cloud, to keep the status information in the cloud in sync.
 """
 
+import logging
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import subprocess
 import os
-import traceback
+import copy
+import socket
+import fcntl
+import struct
+import shutil
+from operator import itemgetter
+from logging.handlers import MemoryHandler
 from threading import Thread
+from collections import deque
+from Queue import Queue
 from ConfigParser import ConfigParser
-from datetime import datetime
+# Prefer the C-implemented ujson for the per-iteration decoding of the
+# webservice responses; fall back to simplejson/json when not installed.
 try:
-    import json
+    import ujson as json
 except ImportError:
-    import simplejson as json
+    try:
+        import simplejson as json
+    except ImportError:
+        import json
 
 import constants
 
 from bus.led_service import LedService
 
+LOGGER = logging.getLogger("vpn_service")
+
 REBOOT_TIMEOUT = 900
 
 
+def setup_logger():
+    """ Setup the vpn service logger: log lines are buffered in memory and flushed to
+    stdout in batches (or immediately on error), instead of one write per line. """
+    LOGGER.setLevel(logging.INFO)
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    LOGGER.addHandler(MemoryHandler(capacity=100, target=handler))
+
+
 def reboot_gateway():
     """ Reboot the gateway. """
     subprocess.call('sync && reboot', shell=True)
@@ -82,12 +108,43 @@ class Cloud(object):
         self.__last_connect = time.time()
         self.__sleep_time = sleep_time
         self.__modes = None
+        self.__last_sent = {}
+        self.__version = 0
+        # Long-lived session: reuses the TCP+TLS connection to the cloud
+        # across checks instead of paying the handshake on every poll.
+        self.__session = requests.Session()
+        self.__session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+    @staticmethod
+    def __encode_extra_data(extra_data):
+        """ Serialize extra_data to json, splicing in the pre-serialized points of the
+        buffering collectors ('values_raw') without re-encoding them. """
+        parts = []
+        for key in extra_data:
+            value = extra_data[key]
+            if isinstance(value, dict) and 'values_raw' in value:
+                parts.append('%s: {"timestamp": %s, "values": [%s]}'
+                             % (json.dumps(key), json.dumps(value['timestamp']),
+                                ",".join(value['values_raw'])))
+            else:
+                parts.append('%s: %s' % (json.dumps(key), json.dumps(value)))
+        return "{" + ", ".join(parts) + "}"
 
     def should_open_vpn(self, extra_data):
-        """ Check with the OpenMotics could if we should open a VPN """
+        """ Check with the OpenMotics could if we should open a VPN. Only the entries of
+        extra_data that changed since the last successful check are posted, together with a
+        version number, so the cloud can reconstruct the full state from the deltas. """
+        delta = {}
+        for key in extra_data:
+            value = extra_data[key]
+            if self.__last_sent.get(key) != value:
+                delta[key] = value
+
         try:
-            request = requests.post(self.__url, data={'extra_data': json.dumps(extra_data)},
-                                    timeout=10.0, verify=True)
+            request = self.__session.post(self.__url,
+                                          data={'extra_data': Cloud.__encode_extra_data(delta),
+                                                'version': self.__version},
+                                          timeout=10.0, verify=True)
             data = json.loads(request.text)
 
             if 'sleep_time' in data:
@@ -107,9 +164,12 @@ class Cloud(object):
             self.__led_service.toggle_led('alive')
             self.__last_connect = time.time()
 
+            self.__last_sent.update(delta)
+            self.__version += 1
+
             return True, data['open_vpn']
         except Exception as exception:
-            print "Exception occured during check: ", exception
+            LOGGER.error("Exception occured during check: %s", exception)
             self.__led_service.set_led('cloud', False)
             self.__led_service.set_led('alive', False)
 
@@ -128,21 +188,82 @@ class Cloud(object):
         return self.__last_connect
 
 
+# The fields copied for each thermostat in Gateway.get_thermostats: the itemgetter
+# extracts them in one C-level call instead of a Python loop per thermostat.
+THERMOSTAT_FIELDS = ('id', 'act', 'csetp', 'mode', 'output0', 'output1', 'outside', 'airco')
+THERMOSTAT_GETTER = itemgetter(*THERMOSTAT_FIELDS)
+
+
 class Gateway(object):
     """ Class to get the current status of the gateway. """
 
+    # Endpoints whose response may be served from cache, with the number of seconds
+    # the cached response stays valid. Endpoints without a ttl are never cached.
+    CACHE_TTLS = {'get_modules': 3600,
+                  'get_last_inputs': 5}
+
     def __init__(self, host="127.0.0.1"):
         self.__host = host
         self.__last_pulse_counters = None
+        self.__cache = {}
+        self.__pc_cache = (0, None)
+        # Long-lived session: keeps the connections to the local webservice
+        # open (keep-alive) instead of doing a TCP handshake per call. The pool
+        # is sized so every concurrently collecting worker gets a connection.
+        self.__session = requests.Session()
+        self.__session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+        self.__prefetched = {}
+
+    def prefetch_bundle(self, items):
+        """ Fetch the responses for multiple endpoints in one webservice call. Subsequent
+        do_call invocations for these endpoints are served from the prefetched responses
+        instead of doing a new http request. Endpoints with a still-fresh entry in the
+        ttl cache are skipped: do_call serves those from the cache. """
+        self.__prefetched = {}
+        now = time.time()
+        items = [item for item in items if now >= self.__cache.get(item, (0, None))[0]]
+        if len(items) == 0:
+            return
+        data = self.do_call("get_bundle?items=%s&token=None" % ",".join(items))
+        if data is not None and data['success'] is not False:
+            self.__prefetched = data['bundle']
+            for (endpoint, response) in self.__prefetched.items():
+                ttl = Gateway.CACHE_TTLS.get(endpoint)
+                if ttl is not None:
+                    self.__cache[endpoint] = (now + ttl, copy.deepcopy(response))
 
     def do_call(self, uri):
         """ Do a call to the webservice, returns a dict parsed from the json returned by the
         webserver. """
+        endpoint = uri.split('?')[0]
+        if endpoint in self.__prefetched:
+            return self.__prefetched.pop(endpoint)
+
+        ttl = Gateway.CACHE_TTLS.get(endpoint)
+        if ttl is not None:
+            (expiry, cached) = self.__cache.get(endpoint, (0, None))
+            if time.time() < expiry:
+                return copy.deepcopy(cached)
+
         try:
-            request = requests.get("http://" + self.__host + "/" + uri, timeout=15.0)
+            request = self.__session.get("http://" + self.__host + "/" + uri, timeout=15.0)
+            data = json.loads(request.text)
+            if ttl is not None:
+                self.__cache[endpoint] = (time.time() + ttl, copy.deepcopy(data))
+            return data
+        except Exception as exception:
+            LOGGER.error("Exception during Gateway call: %s", exception)
+            return None
+
+    def do_call_with_params(self, endpoint, params):
+        """ Do a call to the webservice with the arguments in a params dict, returns a dict
+        parsed from the json returned by the webserver. """
+        try:
+            request = self.__session.get("http://" + self.__host + "/" + endpoint,
+                                         params=params, timeout=15.0)
             return json.loads(request.text)
         except Exception as exception:
-            print "Exception during Gateway call: ", exception
+            LOGGER.error("Exception during Gateway call: %s", exception)
             return None
 
     def get_enabled_outputs(self):
@@ -174,13 +295,8 @@ class Gateway(object):
             ret = {'thermostats_on': data['thermostats_on'],
                    'automatic': data['automatic'],
                    'cooling': data['cooling']}
-            thermostats = []
-            for thermostat in data['status']:
-                to_add = {}
-                for field in ['id', 'act', 'csetp', 'mode', 'output0', 'output1', 'outside', 'airco']:
-                    to_add[field] = thermostat[field]
-                thermostats.append(to_add)
-            ret['status'] = thermostats
+            ret['status'] = [dict(zip(THERMOSTAT_FIELDS, THERMOSTAT_GETTER(thermostat)))
+                             for thermostat in data['status']]
             return ret
 
     def get_update_status(self):
@@ -215,45 +331,49 @@ class Gateway(object):
             del data['success']
             return data
 
-    def get_pulse_counter_status(self):
-        """ Get the total pulse counter values. """
+    def __get_pulse_counters(self):
+        """ Get the raw pulse counter values. Both get_pulse_counter_status and
+        get_pulse_counter_diff need them: the response is reused for one second, so
+        back-to-back calls in the same iteration share a single round trip. """
+        (timestamp, counters) = self.__pc_cache
+        if counters is not None and time.time() - timestamp < 1:
+            return counters
+
         data = self.do_call("get_pulse_counter_status?token=None")
         if data is None or data['success'] is False:
             return None
         else:
+            self.__pc_cache = (time.time(), data['counters'])
             return data['counters']
 
+    def get_pulse_counter_status(self):
+        """ Get the total pulse counter values. """
+        return self.__get_pulse_counters()
+
     def get_pulse_counter_diff(self):
         """ Get the pulse counter differences. """
-        data = self.do_call("get_pulse_counter_status?token=None")
-        if data is None or data['success'] is False:
+        counters = self.__get_pulse_counters()
+        if counters is None:
             return None
         else:
-            counters = data['counters']
-
             if self.__last_pulse_counters is None:
-                ret = [0 for _ in range(0, 24)]
+                ret = [0] * 24
             else:
-                ret = [Gateway.__counter_diff(counters[i], self.__last_pulse_counters[i])
-                       for i in range(0, 24)]
+                # The counters are 16 bit: the modulo handles the wrap-around.
+                ret = [(current - previous) % 65536
+                       for (current, previous) in zip(counters, self.__last_pulse_counters)]
 
             self.__last_pulse_counters = counters
             return ret
 
-    @staticmethod
-    def __counter_diff(current, previous):
-        """ Calculate the diff between two counter values. """
-        diff = current - previous
-        return diff if diff >= 0 else 65536 - previous + current
-
     def get_errors(self):
         """ Get the errors on the gateway. """
         data = self.do_call("get_errors?token=None")
         if data is None:
             return None
         else:
-            if data['errors'] is not None:
-                master_errors = sum([error[1] for error in data['errors']])
+            if data['errors']:
+                master_errors = sum(map(itemgetter(1), data['errors']))
             else:
                 master_errors = 0
 
@@ -262,13 +382,18 @@ class Gateway(object):
                     'power_last_success': data['power_last_success']}
 
     def get_local_ip_address(self):
-        """ Get the local ip address. """
+        """ Get the local ip address of the eth0 interface. """
         _ = self  # Needs to be an instance method
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
-            lines = subprocess.check_output("ifconfig eth0", shell=True)
-            return lines.split("\n")[1].strip().split(" ")[1].split(":")[1]
+            # SIOCGIFADDR (0x8915) returns the interface address in-process,
+            # without forking a shell and parsing ifconfig output.
+            packed = fcntl.ioctl(sock.fileno(), 0x8915, struct.pack('256s', 'eth0'))
+            return socket.inet_ntoa(packed[20:24])
         except:
             return None
+        finally:
+            sock.close()
 
     def get_modules(self):
         """ Get the modules known by the master.
@@ -369,25 +494,28 @@ class DataCollector(object):
         self.__last_collect = 0
         self.__mode = mode
 
-    def __should_collect(self, current_modes):
-        """ Should we execute the collect ? """
+    def should_collect(self, current_modes, now=None):
+        """ Check whether the next call to collect would execute the collect. """
         if self.__mode is not None and (current_modes is None or self.__mode not in current_modes):
             return False
 
-        return self.__period == 0 or time.time() >= self.__last_collect + self.__period
+        if now is None:
+            now = time.time()
+        return self.__period == 0 or now >= self.__last_collect + self.__period
 
-    def collect(self, current_modes):
+    def collect(self, current_modes, now=None):
         """ Execute the collect if required, return None otherwise. """
         try:
-            if self.__should_collect(current_modes):
+            if now is None:
+                now = time.time()
+            if self.should_collect(current_modes, now):
                 if self.__period != 0:
-                    self.__last_collect = time.time()
+                    self.__last_collect = now
                 return self.__function()
             else:
                 return None
-        except Exception as exception:
-            print "Exception while collecting data: ", exception
-            traceback.print_exc()
+        except Exception:
+            LOGGER.exception("Exception while collecting data")
             return None
 
 
@@ -396,32 +524,40 @@ class BufferingDataCollector(DataCollector):
 
     BUFFER_SIZE = 2500  # Elements in the in-memory buffer
     FILE_SIZE = 50 * 1024 * 1024  # Max size of the on-disk buffer
+    STAT_INTERVAL = 100  # Number of writes between file size checks
 
     def __init__(self, function, period=0, mode=None):
         DataCollector.__init__(self, function, period, mode)
         self.__name = function.__name__
         self.__buffer_path = constants.get_buffer_file(self.__name)
-        self.__buffer = []
+        self.__buffer = deque(maxlen=BufferingDataCollector.BUFFER_SIZE)
         self.__read_buffer()
         self.__last_point = None
+        self.__fp = None
+        self.__writes_since_stat = 0
 
     def __read_buffer(self):
         if os.path.exists(self.__buffer_path):
             try:
                 f = open(self.__buffer_path, "r")
                 for line in f:
-                    self.__append_to_buffer(json.loads(line))
+                    json.loads(line)  # Validates the line, the buffer keeps the raw json.
+                    self.__append_to_buffer(line.rstrip("\n"))
                 f.close()
             except Exception as e:
-                print "Exception while reading buffer %s : %s" % (self.__buffer_path, e)
-
-    def collect(self, current_modes):
-        """ Execute the collect if required, return None otherwise. """
-        point = DataCollector.collect(self, current_modes)
+                LOGGER.error("Exception while reading buffer %s : %s", self.__buffer_path, e)
+
+    def collect(self, current_modes, now=None):
+        """ Execute the collect if required, return None otherwise. The buffered points in
+        'values_raw' are pre-serialized json strings, spliced into the payload by the Cloud
+        without re-encoding them. """
+        if now is None:
+            now = time.time()
+        point = DataCollector.collect(self, current_modes, now)
         if point is not None:
-            self.__last_point = [time.time(), point]
+            self.__last_point = json.dumps([now, point])
             self.__append_to_buffer(self.__last_point)
-            return {'timestamp': time.time(), 'values': self.__buffer}
+            return {'timestamp': now, 'values_raw': list(self.__buffer)}
         else:
             return None
 
@@ -430,7 +566,8 @@ class BufferingDataCollector(DataCollector):
         the data was sent succesfully or failed. The BufferingDataCollector buffers the data when
         sending the data failed. If the callback is not called, the data will not be buffered. """
         if success:
-            self.__buffer = []
+            self.__buffer.clear()
+            self.__close_file()
             if os.path.exists(self.__buffer_path):
                 os.remove(self.__buffer_path)
 
@@ -439,32 +576,42 @@ class BufferingDataCollector(DataCollector):
             self.__last_point = None
 
     def __append_to_buffer(self, element):
-        """ Append an element to the buffer, limits the size of the in-memory buffer to BUFFER_SIZE
-        elements. """
+        """ Append an element to the buffer; the deque's maxlen limits the size of the
+        in-memory buffer to BUFFER_SIZE elements. """
         self.__buffer.append(element)
 
-        if len(self.__buffer) > BufferingDataCollector.BUFFER_SIZE:
-                self.__buffer = \
-                    self.__buffer[len(self.__buffer) - BufferingDataCollector.BUFFER_SIZE:]
+    def __close_file(self):
+        """ Close the file buffer handle, if it is open. """
+        if self.__fp is not None:
+            self.__fp.close()
+            self.__fp = None
 
     def __append_to_file(self, element):
-        """ Append an element to the file buffer, limits the size of the buffer to FILE_SIZE. """
-        f = open(self.__buffer_path, "a")
-        f.write("%s\n" % json.dumps(element))
-        f.close()
+        """ Append a pre-serialized element to the file buffer, limits the size of the buffer
+        to FILE_SIZE. The file handle is kept open between writes, and the size is only
+        checked every STAT_INTERVAL writes, to save on open/close/stat syscalls. """
+        if self.__fp is None:
+            self.__fp = open(self.__buffer_path, "a")
+        self.__fp.write("%s\n" % element)
+        self.__fp.flush()
+
+        self.__writes_since_stat += 1
+        if self.__writes_since_stat < BufferingDataCollector.STAT_INTERVAL:
+            return
+        self.__writes_since_stat = 0
 
         # Keep the size of the file limited. When the maximum file size is reached, a new
         # file of half the size if created. The limits the amount of writes on the flash disk.
-        if os.stat(self.__buffer_path).st_size > BufferingDataCollector.FILE_SIZE:
-            old = open(self.__buffer_path, "r")
-            new = open(self.__buffer_path + ".new", "w")
+        if os.fstat(self.__fp.fileno()).st_size > BufferingDataCollector.FILE_SIZE:
+            self.__close_file()
+            old = open(self.__buffer_path, "rb")
+            new = open(self.__buffer_path + ".new", "wb")
 
-            skipped = 0
-            for line in old:
-                if skipped > BufferingDataCollector.FILE_SIZE / 2:
-                    new.write(line)
-                else:
-                    skipped += len(line)
+            # Skip the first half of the file, aligning forward to the next full line, and
+            # bulk-copy the tail instead of iterating over the lines in Python.
+            old.seek(BufferingDataCollector.FILE_SIZE / 2)
+            old.readline()
+            shutil.copyfileobj(old, new, 1 << 20)
 
             new.close()
             old.close()
@@ -473,61 +620,96 @@ class BufferingDataCollector(DataCollector):
             os.rename(self.__buffer_path + ".new", self.__buffer_path)
 
 
+class CollectorPool(object):
+    """ Pool of persistent worker threads that runs the collects of one iteration
+    concurrently, so the independent http calls to the webservice overlap instead
+    of running back to back. """
+
+    def __init__(self, num_workers=8):
+        self.__tasks = Queue()
+        for i in range(num_workers):
+            thread = Thread(name="Collector worker %d" % i, target=self.__worker)
+            thread.daemon = True
+            thread.start()
+
+    def __worker(self):
+        """ Code for the worker threads: executes tasks from the task queue. """
+        while True:
+            (name, function, current_modes, now, results) = self.__tasks.get()
+            try:
+                results.put((name, function(current_modes, now)))
+            except Exception:
+                LOGGER.exception("Exception in collector pool")
+                results.put((name, None))
+
+    def collect_all(self, collectors, current_modes, now=None):
+        """ Run the collect of all collectors concurrently.
+
+        :returns: a dict mapping the collector names on the collected data, \
+        only contains the collectors that returned data.
+        """
+        results = Queue()
+        for (collector_name, collector) in collectors.items():
+            self.__tasks.put((collector_name, collector.collect, current_modes, now, results))
+
+        collected = {}
+        for _ in range(len(collectors)):
+            (collector_name, data) = results.get()
+            if data is not None:
+                collected[collector_name] = data
+        return collected
+
+
+# The actions the cloud can request and the webservice endpoint each maps on. The
+# arguments of an action are passed to the endpoint as request parameters as-is.
+ACTION_ENDPOINTS = {'set_output': 'set_output',
+                    'set_all_lights_off': 'set_all_lights_off',
+                    'set_all_lights_floor_off': 'set_all_lights_floor_off',
+                    'set_all_lights_floor_on': 'set_all_lights_floor_on',
+                    'set_current_setpoint': 'set_current_setpoint',
+                    'set_mode': 'set_mode',
+                    'do_group_action': 'do_group_action'}
+
+
 class ActionExecutor(object):
     """ Executes actions received from the cloud. """
 
     def __init__(self, gateway):
         """ Use a Gateway instance to communicate with the gateway. """
         self.__gateway = gateway
+        self.__actions = Queue()
+
+        thread = Thread(name="Action Executor", target=self.__worker)
+        thread.daemon = True
+        thread.start()
 
     def execute_actions_in_background(self, actions):
-        """ Execute a list of actions in the background. """
-        def run():
-            """ Function that executes a list of actions. """
+        """ Queue a list of actions for execution in the background. """
+        self.__actions.put(actions)
+
+    def __worker(self):
+        """ Executes the queued lists of actions, one batch at a time. """
+        while True:
+            actions = self.__actions.get()
             for action in actions:
                 try:
                     self.execute(action)
                 except Exception as exception:
-                    print "Error wile executing action '" + str(action) + "': " + str(exception)
-
-        thread = Thread(name="Action Executor", target=run)
-        thread.daemon = True
-        thread.start()
+                    LOGGER.error("Error while executing action '%s': %s", action, exception)
 
     def execute(self, action):
         """ Execute an action. """
         name = action.get('name', None)
         args = action.get('args', None)
 
-        if name == 'set_output':
-            self.__gateway.do_call("set_output?id=%s&on=%s&dimmer=%s&timer=%s&token=None" %
-                                   (args['id'], args['on'], args['dimmer'], args['timer']))
-
-        elif name == 'set_all_lights_off':
-            self.__gateway.do_call("set_all_lights_off?token=None")
-
-        elif name == 'set_all_lights_floor_off':
-            self.__gateway.do_call("set_all_lights_floor_off?floor=%s&token=None" % args['floor'])
-
-        elif name == 'set_all_lights_floor_on':
-            self.__gateway.do_call("set_all_lights_floor_on?floor=%s&token=None" % args['floor'])
-
-        elif name == 'set_current_setpoint':
-            self.__gateway.do_call(
-                    "set_current_setpoint?thermostat=%s&temperature=%s&token=None" %
-                    (args['thermostat'], args['temperature']))
-
-        elif name == 'set_mode':
-            self.__gateway.do_call("set_mode?on=%s&automatic=%s&setpoint=%s&token=None" %
-                                   (args['on'], args['automatic'], args['setpoint']))
-
-        elif name == 'do_group_action':
-            self.__gateway.do_call("do_group_action?group_action_id=%s&token=None" %
-                                   args['group_action_id'])
-
-        else:
+        endpoint = ACTION_ENDPOINTS.get(name)
+        if endpoint is None:
             raise Exception("Could not find action '%s'" % name)
 
+        params = dict(args or {})
+        params['token'] = 'None'
+        self.__gateway.do_call_with_params(endpoint, params)
+
 
 def main():
     """ The main function contains the loop that check if the vpn should be opened every 2 seconds.
@@ -563,22 +745,51 @@ def main():
                   'sensor_bri': DataCollector(gateway.get_sensor_brightness_status, 10,
                                               mode='init')}
 
+    # Maps each collector on the webservice endpoints its function calls, so the
+    # endpoints needed in an iteration can be prefetched in one bundle call.
+    collector_endpoints = {'energy': ['get_total_energy'],
+                           'thermostats': ['get_thermostat_status'],
+                           'pulse_totals': ['get_pulse_counter_status'],
+                           'pulses': ['get_pulse_counter_status'],
+                           'outputs': ['get_output_status'],
+                           'power': ['get_realtime_power'],
+                           'errors': ['get_errors'],
+                           'modules': ['get_modules', 'get_power_modules'],
+                           'module_log': ['get_module_log'],
+                           'last_inputs': ['get_last_inputs'],
+                           'sensor_tmp': ['get_sensor_temperature_status'],
+                           'sensor_hum': ['get_sensor_humidity_status'],
+                           'sensor_bri': ['get_sensor_brightness_status']}
+
+    # One worker per collector: every http call of an iteration can be in
+    # flight at the same time, so the collection phase costs one round trip.
+    pool = CollectorPool(num_workers=len(collectors))
+
+    collector_items = collectors.items()
+    buffering_items = [(name, collector) for (name, collector) in collector_items
+                       if isinstance(collector, BufferingDataCollector)]
+
     iterations = 0
 
     # Loop: check vpn and open/close if needed
     while True:
-        vpn_data = {}
-        for collector_name in collectors:
-            collector = collectors[collector_name]
-            data = collector.collect(cloud.get_current_modes())
-            if data is not None:
-                vpn_data[collector_name] = data
+        now = time.time()
+        current_modes = cloud.get_current_modes()
+
+        to_prefetch = []
+        for (collector_name, collector) in collector_items:
+            if collector.should_collect(current_modes, now):
+                for endpoint in collector_endpoints.get(collector_name, []):
+                    if endpoint not in to_prefetch:
+                        to_prefetch.append(endpoint)
+        gateway.prefetch_bundle(to_prefetch)
+
+        vpn_data = pool.collect_all(collectors, current_modes, now)
 
         (success, should_open) = cloud.should_open_vpn(vpn_data)
 
-        for collector_name in vpn_data.keys():
-            collector = collectors[collector_name]
-            if type(collector) == BufferingDataCollector:
+        for (collector_name, collector) in buffering_items:
+            if collector_name in vpn_data:
                 collector.data_sent_callback(success)
 
         if iterations > 20 and cloud.get_last_connect() < time.time() - REBOOT_TIMEOUT:
@@ -590,18 +801,20 @@ def main():
         led_service.set_led('vpn', is_open)
 
         if should_open and not is_open:
-            print str(datetime.now()) + ": opening vpn"
+            LOGGER.info("Opening vpn")
             VpnController.start_vpn()
         elif not should_open and is_open:
-            print str(datetime.now()) + ": closing vpn"
+            LOGGER.info("Closing vpn")
             VpnController.stop_vpn()
 
-        print "Sleeping for %ds" % cloud.get_sleep_time()
-        time.sleep(cloud.get_sleep_time())
+        sleep_time = cloud.get_sleep_time()
+        LOGGER.debug("Sleeping for %ds", sleep_time)
+        time.sleep(sleep_time)
 
         iterations += 1
 
 
 if __name__ == '__main__':
-    print "\nStarting VPN service\n"
+    setup_logger()
+    LOGGER.info("Starting VPN service")
     main()
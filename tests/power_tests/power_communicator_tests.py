@@ -18,84 +18,153 @@ Tests for PowerCommunicator module.
 @author: fryckbos
 """
 
-import unittest
-import os
 import time
+import unittest
 
 import power.power_api as power_api
+import power.power_communicator as power_communicator
 from power.power_controller import PowerController
 from power.power_communicator import PowerCommunicator, InAddressModeException
 
-from serial_tests import SerialMock, sin, sout
+from serial_tests import SerialMock, SerialHolder, FakeClock, sin, sout
 from serial_utils import CommunicationTimedOutException
 
+_payload_cache = {}
+
+def _payload(direction, api_name, address, cid, args):
+    """ Get the serial payload for a power_api command, cached on
+    (direction, api_name, address, cid, args) since the payloads are
+    deterministic. api_name is the name of the power_api factory function,
+    or a tuple of the name and the factory arguments (e.g. the power api
+    version) for parameterized factories. """
+    key = (direction, api_name, address, cid, args)
+    if key not in _payload_cache:
+        if isinstance(api_name, tuple):
+            action = getattr(power_api, api_name[0])(*api_name[1:])
+        else:
+            action = getattr(power_api, api_name)()
+        if direction == 'i':
+            _payload_cache[key] = action.create_input(address, cid, *args)
+        else:
+            _payload_cache[key] = action.create_output(address, cid, *args)
+    return _payload_cache[key]
+
+def _scenario(steps, timeout=0):
+    """ Build a SerialMock from declarative steps. Each step is a tuple
+    (direction, api_name, address, cid, args) as taken by _payload, or the
+    string 'timeout' for an empty (timed out) read. """
+    sequence = []
+    for step in steps:
+        if step == 'timeout':
+            sequence.append(sout(''))
+        elif step[0] == 'i':
+            sequence.append(sin(_payload(*step)))
+        else:
+            sequence.append(sout(_payload(*step)))
+    return SerialMock(sequence, timeout)
+
+# The power_api factories take the power api version; the scenarios below all
+# run against 8-port power modules.
+GET_VOLTAGE = ('get_voltage', power_api.POWER_API_8_PORTS)
+GET_FREQUENCY = ('get_frequency', power_api.POWER_API_8_PORTS)
+SET_DAY_NIGHT = ('set_day_night', power_api.POWER_API_8_PORTS)
+
 class PowerCommunicatorTest(unittest.TestCase):
     """ Tests for PowerCommunicator class """
 
-    FILE = "test.db"
+    @classmethod
+    def setUpClass(cls): #pylint: disable=C0103
+        """ Create the shared in-memory PowerController and the shared started
+        PowerCommunicator, used by all tests that run with default settings. """
+        cls.power_controller = PowerController(":memory:")
+        cls.serial_holder = SerialHolder()
+        cls.comm = PowerCommunicator(cls.serial_holder, cls.power_controller,
+                                     time_keeper_period=0, address_mode_timeout=60)
+        cls.comm.start()
+
+    @classmethod
+    def tearDownClass(cls): #pylint: disable=C0103
+        """ Close the shared PowerController. """
+        cls.power_controller.close()
 
     def setUp(self): #pylint: disable=C0103
-        """ Run before each test. """
-        if os.path.exists(PowerCommunicatorTest.FILE):
-            os.remove(PowerCommunicatorTest.FILE)
+        """ Run before each test: clear the shared database tables and install the
+        virtual clock in the power_communicator module, so the address mode expiry
+        and the retry sleeps in do_command run on virtual time. """
+        PowerCommunicatorTest.power_controller.reset()
+        # Reset the communication id so each test scenario starts at cid 1.
+        self.comm._PowerCommunicator__cid = 1 #pylint: disable=W0212
+
+        self.clock = FakeClock()
+        self.__real_time = power_communicator.time
+        power_communicator.time = self.clock
 
     def tearDown(self): #pylint: disable=C0103
-        """ Run after each test. """
-        if os.path.exists(PowerCommunicatorTest.FILE):
-            os.remove(PowerCommunicatorTest.FILE)
+        """ Run after each test: restore the real clock. """
+        power_communicator.time = self.__real_time
+
+    def __wait_for_normal_mode(self, comm, timeout=5):
+        """ Block until the communicator has left address mode. """
+        end = time.time() + timeout
+        while comm.in_address_mode():
+            if time.time() > end:
+                self.fail("Communicator did not leave address mode")
+            time.sleep(0.01)
 
     def __get_communicator(self, serial_mock, time_keeper_period=0, address_mode_timeout=60,
                            power_controller=None):
         """ Get a PowerCommunicator. """
         if power_controller == None:
-            power_controller = PowerController(PowerCommunicatorTest.FILE)
+            power_controller = PowerCommunicatorTest.power_controller
 
         return PowerCommunicator(serial_mock, power_controller,
                                  time_keeper_period=time_keeper_period,
                                  address_mode_timeout=address_mode_timeout)
 
+    def __get_shared_communicator(self, serial_mock):
+        """ Point the shared (started) PowerCommunicator at the given SerialMock. """
+        PowerCommunicatorTest.serial_holder.set_backend(serial_mock)
+        return PowerCommunicatorTest.comm
+
     def test_do_command(self):
         """ Test for standard behavior PowerCommunicator.do_command. """
-        action = power_api.get_voltage()
+        action = power_api.get_voltage(power_api.POWER_API_8_PORTS)
 
-        serial_mock = SerialMock(
-                        [sin(action.create_input(1, 1)),
-                         sout(action.create_output(1, 1, 49.5))])
+        serial_mock = _scenario([('i', GET_VOLTAGE, 1, 1, ()),
+                                 ('o', GET_VOLTAGE, 1, 1, (49.5,))])
 
-        comm = self.__get_communicator(serial_mock)
-        comm.start()
+        comm = self.__get_shared_communicator(serial_mock)
+        bytes_written = comm.get_bytes_written()
+        bytes_read = comm.get_bytes_read()
 
         output = comm.do_command(1, action)
 
         self.assertEquals((49.5, ), output)
 
-        self.assertEquals(14, comm.get_bytes_written())
-        self.assertEquals(18, comm.get_bytes_read())
+        self.assertEquals(14, comm.get_bytes_written() - bytes_written)
+        self.assertEquals(18, comm.get_bytes_read() - bytes_read)
 
     def test_do_command_timeout_once(self):
         """ Test for timeout in PowerCommunicator.do_command. """
-        action = power_api.get_voltage()
+        action = power_api.get_voltage(power_api.POWER_API_8_PORTS)
 
-        serial_mock = SerialMock([sin(action.create_input(1, 1)), sout(''),
-                                  sin(action.create_input(1, 2)),
-                                  sout(action.create_output(1, 2, 49.5))])
+        serial_mock = _scenario([('i', GET_VOLTAGE, 1, 1, ()), 'timeout',
+                                 ('i', GET_VOLTAGE, 1, 2, ()),
+                                 ('o', GET_VOLTAGE, 1, 2, (49.5,))])
 
-        comm = self.__get_communicator(serial_mock)
-        comm.start()
+        comm = self.__get_shared_communicator(serial_mock)
 
         output = comm.do_command(1, action)
         self.assertEquals((49.5, ), output)
 
     def test_do_command_timeout_twice(self):
         """ Test for timeout in PowerCommunicator.do_command. """
-        action = power_api.get_voltage()
+        action = power_api.get_voltage(power_api.POWER_API_8_PORTS)
 
-        serial_mock = SerialMock([sin(action.create_input(1, 1)), sout(''),
-                                  sin(action.create_input(1, 2)),
-                                  sout('')])
+        serial_mock = _scenario([('i', GET_VOLTAGE, 1, 1, ()), 'timeout',
+                                 ('i', GET_VOLTAGE, 1, 2, ()), 'timeout'])
 
-        comm = self.__get_communicator(serial_mock)
-        comm.start()
+        comm = self.__get_shared_communicator(serial_mock)
 
         try:
             comm.do_command(1, action)
@@ -105,15 +174,14 @@ class PowerCommunicatorTest(unittest.TestCase):
 
     def test_do_command_split_data(self):
         """ Test PowerCommunicator.do_command when the data is split over multiple reads. """
-        action = power_api.get_voltage()
-        out = action.create_output(1, 1, 49.5)
+        action = power_api.get_voltage(power_api.POWER_API_8_PORTS)
+        out = _payload('o', GET_VOLTAGE, 1, 1, (49.5,))
 
         serial_mock = SerialMock(
-                        [sin(action.create_input(1, 1)),
+                        [sin(_payload('i', GET_VOLTAGE, 1, 1, ())),
                          sout(out[:5]), sout(out[5:])])
 
-        comm = self.__get_communicator(serial_mock)
-        comm.start()
+        comm = self.__get_shared_communicator(serial_mock)
 
         output = comm.do_command(1, action)
 
@@ -121,14 +189,12 @@ class PowerCommunicatorTest(unittest.TestCase):
 
     def test_wrong_response(self):
         """ Test PowerCommunicator.do_command when the power module returns a wrong response. """
-        action_1 = power_api.get_voltage()
-        action_2 = power_api.get_frequency()
+        action_1 = power_api.get_voltage(power_api.POWER_API_8_PORTS)
 
-        serial_mock = SerialMock([sin(action_1.create_input(1, 1)),
-                                  sout(action_2.create_output(3, 2, 49.5))])
+        serial_mock = _scenario([('i', GET_VOLTAGE, 1, 1, ()),
+                                 ('o', GET_FREQUENCY, 3, 2, (49.5,))])
 
-        comm = self.__get_communicator(serial_mock)
-        comm.start()
+        comm = self.__get_shared_communicator(serial_mock)
 
         try:
             comm.do_command(1, action_1)
@@ -138,26 +204,24 @@ class PowerCommunicatorTest(unittest.TestCase):
 
     def test_address_mode(self):
         """ Test the address mode. """
-        sad = power_api.set_addressmode()
-        serial_mock = SerialMock(
-            [sin(sad.create_input(power_api.BROADCAST_ADDRESS, 1, power_api.ADDRESS_MODE)),
-             sout(power_api.want_an_address(power_api.POWER_API_8_PORTS).create_output(0, 0)),
-             sin(power_api.set_address().create_input(0, 0, 1)),
-             sout(power_api.want_an_address(power_api.POWER_API_12_PORTS).create_output(0, 0)),
-             sin(power_api.set_address().create_input(0, 0, 2)),
-             sout(''), ## Timeout read after 1 second
-             sin(sad.create_input(power_api.BROADCAST_ADDRESS, 2, power_api.NORMAL_MODE))
+        serial_mock = _scenario(
+            [('i', 'set_addressmode', power_api.BROADCAST_ADDRESS, 1, (power_api.ADDRESS_MODE,)),
+             ('o', ('want_an_address', power_api.POWER_API_8_PORTS), 0, 0, ()),
+             ('i', 'set_address', 0, 0, (1,)),
+             ('o', ('want_an_address', power_api.POWER_API_12_PORTS), 0, 0, ()),
+             ('i', 'set_address', 0, 0, (2,)),
+             'timeout', ## Timed out read
+             ('i', 'set_addressmode', power_api.BROADCAST_ADDRESS, 2, (power_api.NORMAL_MODE,))
             ], 1)
 
-        controller = PowerController(PowerCommunicatorTest.FILE)
-        comm = self.__get_communicator(serial_mock, power_controller=controller)
-        comm.start()
+        controller = PowerCommunicatorTest.power_controller
+        comm = self.__get_shared_communicator(serial_mock)
 
         self.assertEqual(controller.get_free_address(), 1)
 
         comm.start_address_mode()
         self.assertTrue(comm.in_address_mode())
-        time.sleep(0.5)
+        serial_mock.wait_until_remaining(1)  # Only the stop command remains.
         comm.stop_address_mode()
 
         self.assertEqual(controller.get_free_address(), 3)
@@ -165,19 +229,17 @@ class PowerCommunicatorTest(unittest.TestCase):
 
     def test_do_command_in_address_mode(self):
         """ Test the behavior of do_command in address mode."""
-        action = power_api.get_voltage()
-        sad = power_api.set_addressmode()
-
-        serial_mock = SerialMock(
-            [sin(sad.create_input(power_api.BROADCAST_ADDRESS, 1, power_api.ADDRESS_MODE)),
-             sout(''), ## Timeout read after 1 second
-             sin(sad.create_input(power_api.BROADCAST_ADDRESS, 2, power_api.NORMAL_MODE)),
-             sin(action.create_input(1, 3)),
-             sout(action.create_output(1, 3, 49.5))
+        action = power_api.get_voltage(power_api.POWER_API_8_PORTS)
+
+        serial_mock = _scenario(
+            [('i', 'set_addressmode', power_api.BROADCAST_ADDRESS, 1, (power_api.ADDRESS_MODE,)),
+             'timeout', ## Timed out read
+             ('i', 'set_addressmode', power_api.BROADCAST_ADDRESS, 2, (power_api.NORMAL_MODE,)),
+             ('i', GET_VOLTAGE, 1, 3, ()),
+             ('o', GET_VOLTAGE, 1, 3, (49.5,))
             ], 1)
 
-        comm = self.__get_communicator(serial_mock)
-        comm.start()
+        comm = self.__get_shared_communicator(serial_mock)
 
         comm.start_address_mode()
 
@@ -187,51 +249,53 @@ class PowerCommunicatorTest(unittest.TestCase):
         except InAddressModeException:
             pass
 
+        serial_mock.wait_until_remaining(3)  # The timed out read has been consumed.
         comm.stop_address_mode()
 
         self.assertEquals((49.5, ), comm.do_command(1, action))
 
     def test_address_mode_timeout(self):
         """ Test address mode timeout. """
-        action = power_api.get_voltage()
-        sad = power_api.set_addressmode()
-
-        serial_mock = SerialMock(
-            [sin(sad.create_input(power_api.BROADCAST_ADDRESS, 1, power_api.ADDRESS_MODE)),
-             sout(''), ## Timeout read after 1 second
-             sin(sad.create_input(power_api.BROADCAST_ADDRESS, 2, power_api.NORMAL_MODE)),
-             sin(action.create_input(1, 3)),
-             sout(action.create_output(1, 3, 49.5))
+        action = power_api.get_voltage(power_api.POWER_API_8_PORTS)
+
+        serial_mock = _scenario(
+            [('i', 'set_addressmode', power_api.BROADCAST_ADDRESS, 1, (power_api.ADDRESS_MODE,)),
+             'timeout', ## Timed out read
+             ('i', 'set_addressmode', power_api.BROADCAST_ADDRESS, 2, (power_api.NORMAL_MODE,)),
+             ('i', GET_VOLTAGE, 1, 3, ()),
+             ('o', GET_VOLTAGE, 1, 3, (49.5,))
             ], 1)
 
         comm = self.__get_communicator(serial_mock, address_mode_timeout=1)
         comm.start()
 
         comm.start_address_mode()
-        time.sleep(1.1)
+        serial_mock.wait_until_remaining(3)  # The timed out read has been consumed.
+        self.clock.sleep(1.1)  # Move the virtual clock past the address mode timeout.
+        self.__wait_for_normal_mode(comm)
 
         self.assertEquals((49.5, ), comm.do_command(1, action))
 
     def test_timekeeper(self):
         """ Test the TimeKeeper. """
-        power_controller = PowerController(PowerCommunicatorTest.FILE)
-        power_controller.register_power_module(1)
+        power_controller = PowerCommunicatorTest.power_controller
+        power_controller.register_power_module(1, power_api.POWER_API_8_PORTS)
 
-        time_action = power_api.set_day_night()
-        times = [power_api.NIGHT for _ in range(8)]
-        action = power_api.get_voltage()
+        times = tuple(power_api.NIGHT for _ in range(8))
+        action = power_api.get_voltage(power_api.POWER_API_8_PORTS)
 
-        serial_mock = SerialMock(
-            [sin(time_action.create_input(1, 1, *times)),
-             sout(time_action.create_output(1, 1)),
-             sin(action.create_input(1, 2)),
-             sout(action.create_output(1, 2, 243))
+        serial_mock = _scenario(
+            [('i', SET_DAY_NIGHT, 1, 1, times),
+             ('o', SET_DAY_NIGHT, 1, 1, ()),
+             ('i', GET_VOLTAGE, 1, 2, ()),
+             ('o', GET_VOLTAGE, 1, 2, (243,))
             ], 1)
 
         comm = self.__get_communicator(serial_mock, 1, power_controller=power_controller)
         comm.start()
 
-        time.sleep(1.5)
+        # The TimeKeeper sets the day/night mode on startup: wait for that exchange.
+        serial_mock.wait_until_remaining(2)
 
         self.assertEquals((243, ), comm.do_command(1, action))
 
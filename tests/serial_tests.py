@@ -21,6 +21,7 @@ Contains the SerialMock.
 import time
 import threading
 import unittest
+import Queue
 
 from serial_utils import printable
 
@@ -32,8 +33,50 @@ def sout(data):
     """ Output from the SerialMock """
     return ('o', data)
 
+class FakeClock(object):
+    """ Virtual clock, drop-in replacement for the time module in tests:
+    sleep() advances the clock instantly instead of blocking, so sleeps and
+    timeouts become logical events instead of real wall-clock waits. """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        """ Get the current virtual time. """
+        return self.now
+
+    def sleep(self, seconds):
+        """ Advance the virtual clock by the given number of seconds. """
+        self.now += seconds
+
+class SerialHolder(object):
+    """ Thin serial adapter that forwards everything to a swappable backing
+    SerialMock, so one consumer (e.g. a started PowerCommunicator) can be
+    reused across test scenarios. """
+
+    def __init__(self, backend=None):
+        self.__backend = backend
+
+    def set_backend(self, backend):
+        """ Swap in a new backing SerialMock. """
+        self.__backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.__backend, name)
+
+class ReadQueue(object):
+    """ Replicates the read_queue interface of :class`serial_utils.RS485` on top of a
+    SerialMock, handing out the bytes of the sout() entries one by one. """
+
+    def __init__(self, serial_mock):
+        self.__serial_mock = serial_mock
+
+    def get(self, block=True, timeout=None):
+        """ Get a single byte from the sout() data of the SerialMock. """
+        return self.__serial_mock.queue_get(block, timeout)
+
 class SerialMock(object):
-    """ Mockup for :class`serial.Serial`.
+    """ Mockup for :class`serial.Serial` and :class`serial_utils.RS485`.
     TODO Serial timeout is not implemented here
     TODO For sequence: [ sout(" "), sout("two") ]
          read() returns " "
@@ -42,23 +85,28 @@ class SerialMock(object):
 
     def __init__(self, sequence, timeout=0):
         """ Takes a sequence of sin() and sout(). Check if we get the sin bytes on write(),
-        gives the sout bytes to read(). """
+        gives the sout bytes to read() and read_queue.get(). """
         self.__sequence = sequence
         self.__timeout = timeout
+        self.__cond = threading.Condition()
+
+        self.read_queue = ReadQueue(self)
 
         self.bytes_written = 0
         self.bytes_read = 0
 
     def write(self, data):
         """ Write data to serial port """
-        while self.__sequence[0][0] == 'o':
-            time.sleep(0.01)
+        with self.__cond:
+            while len(self.__sequence) > 0 and self.__sequence[0][0] == 'o':
+                self.__cond.wait()
 
-        if data != self.__sequence[0][1]:
-            raise Exception("Got wrong data in SerialMock: expected %s, got %s",
-                            (printable(self.__sequence[0][1]), printable(data)))
-        self.__sequence.pop(0)
-        self.bytes_written += len(data)
+            if data != self.__sequence[0][1]:
+                raise Exception("Got wrong data in SerialMock: expected %s, got %s",
+                                (printable(self.__sequence[0][1]), printable(data)))
+            self.__sequence.pop(0)
+            self.bytes_written += len(data)
+            self.__cond.notify_all()
 
     def read(self, size):
         """ Read size bytes from serial port """
@@ -67,17 +115,62 @@ class SerialMock(object):
 
         if self.__timeout != 0 and self.__sequence[0][1] == '':
             time.sleep(self.__timeout)
-            self.__sequence.pop(0)
+            with self.__cond:
+                self.__sequence.pop(0)
+                self.__cond.notify_all()
             return ''
         else:
-            ret = self.__sequence[0][1][:size]
-            self.__sequence[0] = (self.__sequence[0][0], self.__sequence[0][1][size:])
+            with self.__cond:
+                ret = self.__sequence[0][1][:size]
+                self.__sequence[0] = (self.__sequence[0][0], self.__sequence[0][1][size:])
+
+                if len(self.__sequence[0][1]) == 0:
+                    self.__sequence.pop(0)
+
+                self.bytes_read += len(ret)
+                self.__cond.notify_all()
+                return ret
+
+    def queue_get(self, block=True, timeout=None):
+        """ Get a single byte from the sout() entries, like the read_queue of the RS485
+        wrapper does. An empty sout() entry simulates a period in which no data arrives:
+        it is consumed and Queue.Empty is raised. """
+        with self.__cond:
+            end = None if timeout is None else time.time() + timeout
+            while len(self.__sequence) == 0 or self.__sequence[0][0] == 'i':
+                if not block:
+                    raise Queue.Empty()
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise Queue.Empty()
+                self.__cond.wait(remaining)
+
+            if self.__sequence[0][1] == '':
+                self.__sequence.pop(0)
+                self.__cond.notify_all()
+                raise Queue.Empty()
 
+            byte = self.__sequence[0][1][0]
+            self.__sequence[0] = ('o', self.__sequence[0][1][1:])
             if len(self.__sequence[0][1]) == 0:
                 self.__sequence.pop(0)
 
-            self.bytes_read += len(ret)
-            return ret
+            self.bytes_read += 1
+            self.__cond.notify_all()
+            return byte
+
+    def wait_until_remaining(self, number, timeout=5):
+        """ Block until at most `number` entries remain in the sequence, i.e. until the
+        communication up to that point has happened. Lets tests synchronize with a
+        communication thread instead of sleeping and hoping it has caught up. """
+        with self.__cond:
+            end = time.time() + timeout
+            while len(self.__sequence) > number:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    raise Exception("SerialMock sequence stuck at %d entries"
+                                    % len(self.__sequence))
+                self.__cond.wait(remaining)
 
     def inWaiting(self): #pylint: disable=C0103
         """ Get the number of bytes pending to be read """
@@ -90,7 +183,9 @@ class SerialMock(object):
         """ Interrupt a read that is waiting until the end of time. """
         if len(self.__sequence) > 0:
             raise Exception("Can only interrupt read at end of stream")
-        self.__sequence.append(sout("\x00"))
+        with self.__cond:
+            self.__sequence.append(sout("\x00"))
+            self.__cond.notify_all()
 
 class SerialMockTest(unittest.TestCase):
     """ Tests for SerialMock class """
@@ -23,6 +23,7 @@ import threading
 import unittest
 import os
 
+import vpn_service
 from vpn_service import BufferingDataCollector
 
 import constants
@@ -39,6 +40,10 @@ def advance_time():
 
 reset_time()
 
+def point(timestamp, data):
+    """ A serialized buffer point, as stored by the BufferingDataCollector. """
+    return vpn_service.json.dumps([timestamp, data])
+
 def gen():
     accum = { 'i' : 0 }
     def get_data():
@@ -61,14 +66,14 @@ class BufferingDataCollectorTest(unittest.TestCase):
         reset_time()
         self.assertEquals(
             {'timestamp' : time.time(),
-            'values' : [[123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]]]]},
+            'values_raw' : [point(123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]])]},
             bdc.collect(''))
         bdc.data_sent_callback(True)
         advance_time()
 
         self.assertEquals(
             {'timestamp' : time.time(),
-            'values' : [[123456790.0, [[2, 3], [3, 4], [4, 5], [5, 6]]]]},
+            'values_raw' : [point(123456790.0, [[2, 3], [3, 4], [4, 5], [5, 6]])]},
             bdc.collect(''))
         bdc.data_sent_callback(True)
 
@@ -78,23 +83,23 @@ class BufferingDataCollectorTest(unittest.TestCase):
         reset_time()
         self.assertEquals(
             {'timestamp' : time.time(),
-            'values' : [[123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]]]]},
+            'values_raw' : [point(123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]])]},
             bdc.collect(''))
         bdc.data_sent_callback(False)
         advance_time()
 
         self.assertEquals(
             {'timestamp' : time.time(),
-            'values' : [
-            [123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]]],
-            [123456790.0, [[2, 3], [3, 4], [4, 5], [5, 6]]]]},
+            'values_raw' : [
+            point(123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]]),
+            point(123456790.0, [[2, 3], [3, 4], [4, 5], [5, 6]])]},
             bdc.collect(''))
         bdc.data_sent_callback(True)
         advance_time()
 
         self.assertEquals(
             {'timestamp' : time.time(),
-            'values' : [[123456791.0, [[3, 4], [4, 5], [5, 6], [6, 7]]]]},
+            'values_raw' : [point(123456791.0, [[3, 4], [4, 5], [5, 6], [6, 7]])]},
             bdc.collect(''))
         bdc.data_sent_callback(True)
 
@@ -106,24 +111,24 @@ class BufferingDataCollectorTest(unittest.TestCase):
         reset_time()
         self.assertEquals(
             {'timestamp' : time.time(),
-            'values' : [[123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]]]]},
+            'values_raw' : [point(123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]])]},
             bdc.collect(''))
         bdc.data_sent_callback(False)
         advance_time()
         self.assertEquals(
             {'timestamp' : time.time(),
-            'values' : [
-            [123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]]],
-            [123456790.0, [[2, 3], [3, 4], [4, 5], [5, 6]]]]},
+            'values_raw' : [
+            point(123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]]),
+            point(123456790.0, [[2, 3], [3, 4], [4, 5], [5, 6]])]},
             bdc.collect(''))
         bdc.data_sent_callback(False)
         advance_time()
         self.assertEquals(
             {'timestamp' : time.time(),
-            'values' : [
-            [123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]]],
-            [123456790.0, [[2, 3], [3, 4], [4, 5], [5, 6]]],
-            [123456791.0, [[3, 4], [4, 5], [5, 6], [6, 7]]]]},
+            'values_raw' : [
+            point(123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]]),
+            point(123456790.0, [[2, 3], [3, 4], [4, 5], [5, 6]]),
+            point(123456791.0, [[3, 4], [4, 5], [5, 6], [6, 7]])]},
             bdc.collect(''))
         bdc.data_sent_callback(False)
         advance_time()
@@ -131,11 +136,11 @@ class BufferingDataCollectorTest(unittest.TestCase):
         bdc2 = BufferingDataCollector(get_data, 1)
         self.assertEquals(
             {'timestamp' : time.time(),
-            'values' : [
-            [123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]]],
-            [123456790.0, [[2, 3], [3, 4], [4, 5], [5, 6]]],
-            [123456791.0, [[3, 4], [4, 5], [5, 6], [6, 7]]],
-            [123456792.0, [[4, 5], [5, 6], [6, 7] ,[7, 8]]]]},
+            'values_raw' : [
+            point(123456789.0, [[1, 2], [2, 3], [3, 4], [4, 5]]),
+            point(123456790.0, [[2, 3], [3, 4], [4, 5], [5, 6]]),
+            point(123456791.0, [[3, 4], [4, 5], [5, 6], [6, 7]]),
+            point(123456792.0, [[4, 5], [5, 6], [6, 7] ,[7, 8]])]},
             bdc2.collect(''))
         bdc.data_sent_callback(True)
         advance_time()
@@ -143,7 +148,7 @@ class BufferingDataCollectorTest(unittest.TestCase):
         bdc3 = BufferingDataCollector(get_data, 1)
         self.assertEquals(
             {'timestamp' : time.time(),
-            'values' : [[123456793.0, [[5, 6], [6, 7] ,[7, 8], [8, 9]]]]},
+            'values_raw' : [point(123456793.0, [[5, 6], [6, 7] ,[7, 8], [8, 9]])]},
             bdc3.collect(''))
         bdc.data_sent_callback(True)
 
@@ -164,7 +169,8 @@ class BufferingDataCollectorTest(unittest.TestCase):
         
         f = open(path, 'r')
         line = f.readline()
-        self.assertEquals('[123764780.0, [[307992, 307993], [307993, 307994], [307994, 307995], [307995, 307996]]]\n', line)
+        self.assertEquals(point(123764780.0, [[307992, 307993], [307993, 307994],
+                                              [307994, 307995], [307995, 307996]]) + '\n', line)
         f.close()
 
 